@@ -1,25 +1,27 @@
 # fix_admin_hash.py
 import sqlite3
-from werkzeug.security import generate_password_hash
+
+# نفس دالة التشفير في server.py (bcrypt$<hash> أو werkzeug إن لم يكن bcrypt مثبتاً)
+from server import hash_password
 
 DB_PATH = "admins.db"
 
 def fix_admin_password():
     conn = sqlite3.connect(DB_PATH)
     cur = conn.cursor()
+    # أداة صيانة لمرة واحدة: لا حاجة لمزامنة القرص بعد كل كتابة
+    cur.execute("PRAGMA synchronous=OFF")
     
-    # Check if admin exists
-    cur.execute("SELECT password FROM admins WHERE username = 'admin'")
+    # Check if admin exists and whether its password looks like plain text (short)
+    cur.execute("SELECT CASE WHEN length(password) < 50 THEN 1 ELSE 0 END FROM admins WHERE username = 'admin'")
     row = cur.fetchone()
     
     if row:
-        current_pw = row[0]
-        # If password doesn't look like a hash (simple check: length), update it
-        if len(current_pw) < 50:
+        if row[0]:
             print(f"Updating plain text password for 'admin'...")
-            hashed_pw = generate_password_hash("admin123")
-            cur.execute("UPDATE admins SET password = ? WHERE username = 'admin'", (hashed_pw,))
-            conn.commit()
+            hashed_pw = hash_password("admin123")
+            with conn:
+                cur.execute("UPDATE admins SET password = ? WHERE username = 'admin'", (hashed_pw,))
             print("Password updated successfully to hash.")
         else:
             print("Password already appears to be hashed.")
@@ -7,21 +7,61 @@
 
 from __future__ import annotations
 import os
+import io
+import csv
+import atexit
+import hmac
 import json
+import math
+import queue
+import shutil
 import sqlite3
 import datetime
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import wraps
+from pathlib import Path
 from typing import Any, Dict, List
 
 # مكتبات فلاسك الأساسية
 from flask import (
     Flask, render_template, request, redirect, url_for,
-    session, send_file, abort, flash, jsonify, make_response
+    session, send_from_directory, abort, flash, g,
+    Response, stream_with_context, has_app_context
 )
-
-# مكتبات التشفير والحماية
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import safe_join
+
+# orjson اختياري (محلل JSON أسرع مكتوب بـ C)، وإلا نستخدم json القياسية
+try:
+    import orjson
+    json_loads = orjson.loads
+    def json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    json_loads = json.loads
+    def json_dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+# Flask-Caching اختياري، وإلا نستخدم كاشاً بسيطاً داخل العملية (انظر _LocalCache)
+try:
+    from flask_caching import Cache
+except ImportError:
+    Cache = None
+
+# Flask-Compress اختياري: ضغط gzip/br لصفحات HTML العربية (brotli إن كان مثبتاً)
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
+
+# fcntl غير متوفر على ويندوز (نسخة EXE)، وهناك يعمل عامل واحد فقط
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 
 # ========================================================
@@ -56,6 +96,16 @@ app = Flask(
     template_folder=TEMPLATE_DIR
 )
 
+# في الإنتاج: لا داعي لفحص تاريخ تعديل القوالب مع كل طلب (بطيء على PythonAnywhere)
+# ملاحظة: TEMPLATES_AUTO_RELOAD يبقى None حتى يعيد app.run(debug=True) تفعيل التحديث أثناء التطوير
+if not app.debug:
+    app.jinja_env.auto_reload = False
+if Compress is not None:
+    Compress(app)
+# حذف الأسطر الفارغة التي تتركها وسوم {% %} لتقليل حجم HTML المرسل
+app.jinja_env.trim_blocks = True
+app.jinja_env.lstrip_blocks = True
+
 # إعدادات الأمان والمجلدات
 app.config["SECRET_KEY"] = os.environ.get(
     "SECRET_KEY",
@@ -63,11 +113,49 @@ app.config["SECRET_KEY"] = os.environ.get(
 )
 
 # uploads داخل مجلد المشروع (مهم على PythonAnywhere)
-app.config["UPLOAD_FOLDER"] = os.path.join(BASE_DIR, "uploads")
-app.config["ALLOWED_EXTENSIONS"] = {'png', 'jpg', 'jpeg', 'pdf', 'doc', 'docx'}
+UPLOAD_DIR = Path(BASE_DIR, "uploads")
+app.config["UPLOAD_FOLDER"] = str(UPLOAD_DIR)
+ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'pdf', 'doc', 'docx'})
+app.config["ALLOWED_EXTENSIONS"] = ALLOWED_EXTENSIONS
 
 # إنشاء مجلد الرفع إذا لم يكن موجوداً
-os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
+UPLOAD_DIR.mkdir(exist_ok=True)
+
+class _LocalCache:
+    """
+    بديل مصغر لـ SimpleCache من Flask-Caching (get/set/delete مع مهلة انتهاء)
+    خاص بكل عامل، لذا قد يرى عامل آخر بيانات قديمة حتى تنتهي المهلة
+    """
+    def __init__(self, max_items: int = 1000):
+        self._data: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._max_items = max_items
+
+    def get(self, key: str):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+    def set(self, key: str, value, timeout: int = 300) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if len(self._data) >= self._max_items:
+                self._data = {k: v for k, v in self._data.items() if v[0] >= now}
+            self._data[key] = (now + timeout, value)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+# CACHE_TYPE=RedisCache (مع CACHE_REDIS_URL) يجعل الكاش مشتركاً بين العمال فيصل الإبطال للجميع
+if Cache is not None:
+    _cache_config = {"CACHE_TYPE": os.environ.get("CACHE_TYPE", "SimpleCache"), "CACHE_DEFAULT_TIMEOUT": 300}
+    if os.environ.get("CACHE_REDIS_URL"):
+        _cache_config["CACHE_REDIS_URL"] = os.environ["CACHE_REDIS_URL"]
+    cache = Cache(app, config=_cache_config)
+else:
+    cache = _LocalCache()
 
 
 # ========================================================
@@ -76,33 +164,194 @@ os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
 def allowed_file(filename: str) -> bool:
     """ التحقق من امتداد الملف المرفوع """
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config["ALLOWED_EXTENSIONS"]
+    _, dot, ext = filename.rpartition('.')
+    return bool(dot) and ext.lower() in ALLOWED_EXTENSIONS
+
+UPLOAD_CHUNK = 1 << 20  # 1MB لكل عملية كتابة
+
+# عامل خلفي واحد لحذف الملفات المرفوعة، ينهي ما تبقى قبل إيقاف التطبيق
+_file_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="uploads")
+atexit.register(_file_executor.shutdown)
+
+def _remove_uploads(fnames) -> None:
+    for fname in fnames:
+        try:
+            os.remove(UPLOAD_DIR / fname)
+        except OSError:
+            pass
+
+def remove_uploads_later(fnames) -> None:
+    """ جدولة حذف ملفات من uploads بدون انتظار القرص داخل الطلب """
+    fnames = [f for f in fnames if f]
+    if fnames:
+        _file_executor.submit(_remove_uploads, fnames)
+
+def save_upload(f, fname: str) -> None:
+    """
+    حفظ الملف المرفوع بكتل كبيرة في ملف مؤقت ثم نقله للاسم النهائي،
+    حتى لا يبقى ملف ناقص باسمه الحقيقي إذا انقطع الرفع
+    """
+    dst = UPLOAD_DIR / fname
+    tmp = dst.with_name(dst.name + ".part")
+    try:
+        with open(tmp, "wb", buffering=UPLOAD_CHUNK) as out:
+            shutil.copyfileobj(f.stream, out, length=UPLOAD_CHUNK)
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
 
 def generate_csrf_token() -> str:
-    """ إنشاء رمز حماية ضد هجمات CSRF """
-    if '_csrf_token' not in session:
-        session['_csrf_token'] = os.urandom(24).hex()
-    return session['_csrf_token']
+    """
+    إنشاء رمز حماية ضد هجمات CSRF
+    يُحفظ الرمز في g طوال الطلب، ولا نكتب في الجلسة إلا عند إنشاء رمز جديد
+    """
+    tok = getattr(g, "_csrf", None)
+    if tok:
+        return tok
+    tok = session.get('_csrf_token')
+    if not tok:
+        tok = os.urandom(24).hex()
+        session['_csrf_token'] = tok
+    g._csrf = tok
+    return tok
 
 app.jinja_env.globals['csrf_token'] = generate_csrf_token
 
+def start_user_session(user: Dict[str, Any]) -> None:
+    """
+    تسجيل المستخدم في الجلسة مع رمز CSRF جديد
+    الرمز ثابت طوال الجلسة ولا يتغير إلا عند الدخول أو الخروج
+    """
+    session.pop('_csrf_token', None)
+    g.pop('_csrf', None)
+    session["user"] = user
+
 @app.before_request
 def csrf_protect():
     """
     التحقق من رمز الحماية قبل كل طلب POST
     ✅ تم تعديلها لتكون مستقرة (بدون pop) حتى لا تسبب 403 عشوائي
+    طلبات JSON ترسل الرمز في الترويسة X-CSRF-Token بدلاً من حقل النموذج
     """
     if request.method == "POST":
         token = session.get('_csrf_token')
-        form_token = request.form.get('csrf_token')
-        if not token or not form_token or token != form_token:
+        if request.is_json:
+            form_token = request.headers.get('X-CSRF-Token')
+        else:
+            form_token = request.form.get('csrf_token')
+        if not token or not form_token or not hmac.compare_digest(token.encode(), form_token.encode()):
             abort(403)
 
+# كلفة bcrypt (2^10 جولة ≈ 100-200ms على السيرفر)
+BCRYPT_ROUNDS = 10
+BCRYPT_PREFIX = "bcrypt$"
+
+# مكتبات التشفير تُحمّل عند أول عملية تسجيل دخول فقط (أسرع لإقلاع العامل)
+# bcrypt اختياري: إن لم يكن مثبتاً نستمر بتشفير werkzeug الافتراضي
+_bcrypt = None
+
+def _get_bcrypt():
+    global _bcrypt
+    if _bcrypt is None:
+        try:
+            import bcrypt
+            _bcrypt = bcrypt
+        except ImportError:
+            _bcrypt = False
+    return _bcrypt
+
+def hash_password(password: str) -> str:
+    """ تشفير كلمة المرور بـ bcrypt (مع بادئة bcrypt$) أو werkzeug كبديل """
+    bcrypt = _get_bcrypt()
+    if not bcrypt:
+        from werkzeug.security import generate_password_hash
+        return generate_password_hash(password)
+    hashed = bcrypt.hashpw(password.encode()[:72], bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+    return BCRYPT_PREFIX + hashed.decode()
+
+def verify_password(stored: str, password: str) -> bool:
+    """ التحقق من كلمة المرور حسب نوع التشفير المخزن (bcrypt أو werkzeug القديم) """
+    if stored.startswith(BCRYPT_PREFIX):
+        bcrypt = _get_bcrypt()
+        if not bcrypt:
+            return False
+        return bcrypt.checkpw(password.encode()[:72], stored[len(BCRYPT_PREFIX):].encode())
+    from werkzeug.security import check_password_hash
+    return check_password_hash(stored, password)
+
+def same_secret(given: str, expected: str) -> bool:
+    """ مقارنة بزمن ثابت (لكلمة المرور الأولى = الرقم الجامعي) حتى لا يكشف التوقيت عدد الأحرف المطابقة """
+    return hmac.compare_digest(given.encode(), expected.encode())
+
+def password_needs_rehash(stored: str) -> bool:
+    """
+    هل التشفير المخزن أبطأ أو أقدم من الحالي؟ (werkzeug pbkdf2/scrypt أو كلفة bcrypt مختلفة)
+    يُعاد تشفيره بعد أول دخول ناجح، لأن كلمة المرور الصريحة متوفرة حينها فقط
+    """
+    if not _get_bcrypt():
+        return False
+    if not stored.startswith(BCRYPT_PREFIX):
+        return True
+    # الصيغة: bcrypt$$2b$10$<salt+hash>
+    parts = stored[len(BCRYPT_PREFIX):].split("$")
+    return len(parts) < 4 or parts[2] != f"{BCRYPT_ROUNDS:02d}"
+
+def _clean_mark(mark):
+    """ درجة سعي واحدة كرقم: صحيحة إن أمكن وإلا عشرية، وغير الصالحة (فارغة، null، نص) تصبح 0 """
+    try:
+        val = float(mark)
+    except (TypeError, ValueError, OverflowError):
+        return 0
+    if not math.isfinite(val):
+        return 0
+    return int(val) if val.is_integer() else val
+
+_EMPTY_BREAKDOWN = "[0,0,0,0,0]"
+
+def _parse_breakdown(raw, strict: bool = False):
+    """
+    قراءة درجات السعي (نص JSON) كقائمة أرقام بنفس عدد العناصر، للبوابة وصفحة التعديل والترحيل
+    القيمة الفارغة أو التالفة قائمة فارغة (أو None مع strict للتالفة، حتى لا تُستبدل عند الترحيل)
+    """
+    if not raw:
+        return []
+    if raw == _EMPTY_BREAKDOWN:
+        return [0] * 5
+    try:
+        marks = json_loads(raw)
+    except ValueError:
+        marks = None
+    if not isinstance(marks, list):
+        return None if strict else []
+    return [_clean_mark(m) for m in marks]
+
+# صفحة التعديل تمرر صفوف sqlite3.Row كما هي، وتُقرأ الدرجات داخل القالب بالدالة نفسها
+app.jinja_env.filters['breakdown'] = _parse_breakdown
+
+PORTAL_CACHE_TIMEOUT = 300
+
+def _portal_cache_key(student_db_id) -> str:
+    return f"portal:{student_db_id}"
+
+def invalidate_portal(student_db_id) -> None:
+    """ حذف بيانات بوابة الطالب من الكاش بعد أي تعديل على معلوماته أو مواده """
+    if student_db_id:
+        cache.delete(_portal_cache_key(student_db_id))
+
 def safe_int(v, default=0) -> int:
     """ تحويل آمن للنصوص إلى أرقام لتجنب الأخطاء """
+    # حقول النماذج الفارغة هي الحالة الأكثر شيوعاً، فنتجاوزها بدون استثناء
+    if v is None or v == "":
+        return default
+    if type(v) is int:
+        return v
     try:
         return int(v)
-    except Exception:
+    except (TypeError, ValueError, OverflowError):
         return default
 
 
@@ -114,217 +363,675 @@ def safe_int(v, default=0) -> int:
 ADMINS_DB_PATH = os.path.join(BASE_DIR, "admins.db")
 STUDENTS_DB_PATH = os.path.join(BASE_DIR, "students.db")
 
+# --- استعلامات المسارات الأكثر استخداماً (نص ثابت حتى يُعاد استخدام الجمل المحضرة) ---
+SQL_ALL_ADMINS = "SELECT username, password, role FROM admins ORDER BY username"
+SQL_LOGIN_STUDENT = "SELECT id, full_name, student_id, password FROM students WHERE student_id=?"
+SQL_SET_ADMIN_PASSWORD = "UPDATE admins SET password=? WHERE username=?"
+SQL_SET_STUDENT_PASSWORD = "UPDATE students SET password=? WHERE id=?"
+SQL_STUDENT_PASSWORD = "SELECT student_id, password FROM students WHERE id=?"
+SQL_ADD_ADMIN = "INSERT INTO admins(username,password,role) VALUES(?,?,?)"
+SQL_DELETE_ADMIN = "DELETE FROM admins WHERE username = ?"
+SQL_PORTAL_INFO = "SELECT full_name, student_id, college, department FROM students WHERE id=?"
+SQL_PORTAL_COURSES = (
+    "SELECT course_name, semester, coursework_total, final_exam, grade, coursework_breakdown "
+    "FROM courses WHERE student_id=?"
+)
+# صفحات معالج الإدخال: قراءة سجل الطالب من كل جدول
+SQL_STUDENT_EXISTS = "SELECT 1 FROM students WHERE id=?"
+SQL_GET_STUDENT = "SELECT * FROM students WHERE id=?"
+SQL_GET_ADMISSION = "SELECT * FROM admission WHERE student_id=?"
+SQL_GET_COURSES = "SELECT * FROM courses WHERE student_id=?"
+SQL_GET_RESEARCH = "SELECT * FROM research WHERE student_id=?"
+SQL_GET_COMPETENCY = "SELECT * FROM competency WHERE student_id=?"
+SQL_GET_PLAN = "SELECT * FROM plan WHERE student_id=?"
+SQL_SAVE_ADMISSION = (
+    "INSERT OR REPLACE INTO admission (student_id, type, year, avg, notes, graduation_date) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+SQL_SAVE_RESEARCH = """INSERT OR REPLACE INTO research
+    (student_id, title, supervisor, start_date, keywords, abstract, research_filename, credits, grade)
+    VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, (SELECT research_filename FROM research WHERE student_id=?)), ?, ?)"""
+SQL_UPDATE_STUDENT_INFO = """UPDATE students SET full_name=?, full_name_en=?, student_id=?, email=?, phone=?, college=?,
+    department=?, department_en=?, level=?, level_en=?, study_type=?,
+    image_filename=COALESCE(?, image_filename)
+    WHERE id=?"""
+SQL_INSERT_STUDENT_INFO = """INSERT INTO students (full_name, full_name_en, student_id, email, phone, college, department,
+    department_en, level, level_en, study_type, image_filename)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+SQL_ADD_COURSE = "INSERT INTO courses (student_id, course_name, semester, credits) VALUES (?, ?, ?, ?)"
+SQL_DELETE_COURSE = "DELETE FROM courses WHERE id=? AND student_id=?"
+SQL_GRADE_COURSE = (
+    "UPDATE courses SET coursework_total=?, coursework_breakdown=?, final_exam=?, grade=? "
+    "WHERE id=? AND student_id=?"
+)
+SQL_COURSES_AVG = "SELECT AVG(CAST(grade AS REAL)) FROM courses WHERE student_id=?"
+SQL_SAVE_ADMISSION_AVG = "INSERT OR REPLACE INTO admission (student_id, type, year, avg, notes) VALUES (?, ?, ?, ?, ?)"
+SQL_EXPORT_STUDENTS = (
+    "SELECT s.id, s.full_name, s.student_id, s.level, s.study_type, s.department, s.college, a.avg, a.type "
+    "FROM students s LEFT JOIN admission a ON s.id=a.student_id ORDER BY s.id DESC"
+)
+SQL_SAVE_COMPETENCY = (
+    "INSERT OR REPLACE INTO competency (student_id, exam_result, exam_date, english_result, notes) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+SQL_SAVE_PLAN = (
+    "INSERT OR REPLACE INTO plan (student_id, committee_name, supervisor, discussion_date, notes) "
+    "VALUES (?, ?, ?, ?, ?)"
+)
+SQL_GET_PLAN_MEMBERS = "SELECT name FROM plan_members WHERE student_id=? ORDER BY rowid"
+SQL_ADD_PLAN_MEMBER = "INSERT OR IGNORE INTO plan_members (student_id, name) VALUES (?, ?)"
+SQL_DELETE_PLAN_MEMBER = "DELETE FROM plan_members WHERE student_id=? AND name=?"
+# عدد الأسطر في جملة VALUES واحدة (سطران لكل مادة، وحد SQLite القديم 999 متغيراً)
+SQL_MAX_VALUES_ROWS = 490
+# بنك المواد: تُلحق بها مجموعات "(?, ?)" بعدد المواد
+SQL_ADD_AVAILABLE = "INSERT OR IGNORE INTO available_courses (course_name, default_credits) VALUES "
+SQL_AVAILABLE_VERSION = "SELECT MAX(id) FROM available_courses"
+SQL_AVAILABLE_COURSES = "SELECT course_name, default_credits FROM available_courses ORDER BY course_name"
+# استعلاما قائمة الطلاب وسجل البحوث، تُلحق بهما شروط البحث والتصفية
+SQL_STUDENTS_LIST = (
+    "SELECT s.id, s.full_name, s.student_id, s.study_type, s.level, a.avg, a.type as admission_type "
+    "FROM students s LEFT JOIN admission a ON s.id = a.student_id WHERE 1=1"
+)
+SQL_RESEARCH_REGISTRY = (
+    "SELECT s.full_name, s.student_id as uid, r.title, r.supervisor, r.start_date, r.research_filename "
+    "FROM research r JOIN students s ON r.student_id=s.id WHERE 1=1"
+)
+SQL_DASHBOARD_STATS = (
+    "SELECT level_code, study_type, COUNT(*) FROM students GROUP BY level_code, study_type"
+)
+
+# رمز المرحلة الدراسية المخزن في students.level_code (0 ماجستير، 1 دكتوراه، 2 غير ذلك)
+LEVEL_MASTER, LEVEL_PHD, LEVEL_OTHER = 0, 1, 2
+_LEVEL_CODE_EXPR = (
+    f"CASE WHEN {{col}} LIKE '%ماجستير%' THEN {LEVEL_MASTER} "
+    f"WHEN {{col}} LIKE '%دكتوراه%' THEN {LEVEL_PHD} ELSE {LEVEL_OTHER} END"
+)
+
+# الأعمدة التي يعرضها قالب بوابة الطالب (بترتيب SQL_PORTAL_COURSES نفسه)
+_COURSE_COLS = ("course_name", "semester", "coursework_total", "final_exam", "grade", "coursework_breakdown")
+
+# جداول (1:1) المرتبطة بالطالب: (الجدول، الاسم المختصر، الأعمدة)
+_ADMISSION_JOIN = ("admission", "a", ("student_id", "type", "year", "avg", "notes", "graduation_date"))
+_RESEARCH_JOIN = ("research", "r", ("student_id", "title", "supervisor", "start_date", "keywords",
+                                    "abstract", "research_filename", "credits", "grade"))
+_COMPETENCY_JOIN = ("competency", "comp", ("student_id", "exam_result", "exam_date", "english_result", "notes"))
+_PLAN_JOIN = ("plan", "p", ("student_id", "committee_name", "supervisor", "discussion_date", "notes"))
+
+def _student_join_sql(joins) -> str:
+    """ بناء استعلام واحد للطالب مع جداوله الفرعية، بأسماء مستعارة (a__type ...) لتجنب التعارض """
+    cols = ", ".join(f"{al}.{c} AS {al}__{c}" for _, al, table_cols in joins for c in table_cols)
+    sql_joins = " ".join(f"LEFT JOIN {t} {al} ON {al}.student_id = s.id" for t, al, _ in joins)
+    return f"SELECT s.*, {cols} FROM students s {sql_joins} WHERE s.id=?"
+
+_FULL_JOINS = (_ADMISSION_JOIN, _RESEARCH_JOIN, _COMPETENCY_JOIN, _PLAN_JOIN)
+SQL_STUDENT_FULL = _student_join_sql(_FULL_JOINS)
+SQL_STUDENT_ADMISSION = _student_join_sql((_ADMISSION_JOIN,))
+
+# معدلا الفصلين ومجموع الوحدات لكشف الدرجات، بمسح واحد داخل SQLite
+# تُحتسب المادة فقط إن كانت درجتها رقماً عشرياً عادياً (إشارة اختيارية، أرقام، نقطة واحدة على الأكثر)
+# ووحداتها رقماً أو فارغة، كما كان float()/int() يقبلانها؛ أما "-" و"1e" وما شابه فتُستبعد مع وحداتها
+SQL_PRINT_GRADES = """
+    SELECT TOTAL(CASE WHEN sem = 1 THEN CAST(g AS REAL) END), COUNT(CASE WHEN sem = 1 THEN 1 END),
+           TOTAL(CASE WHEN sem = 2 THEN CAST(g AS REAL) END), COUNT(CASE WHEN sem = 2 THEN 1 END),
+           COALESCE(SUM(CAST(COALESCE(NULLIF(credits, ''), 0) AS INTEGER)), 0)
+    FROM (
+        SELECT trim(grade, char(32, 9, 10, 13)) AS g, credits,
+               CASE WHEN instr(semester, 'أول') THEN 1 WHEN instr(semester, 'ثاني') THEN 2 END AS sem
+        FROM courses
+        WHERE student_id = ?
+    )
+    WHERE g GLOB '[0-9.+-]*' AND g GLOB '*[0-9]*'
+      AND substr(g, 2) NOT GLOB '*[^0-9.]*' AND g NOT GLOB '*.*.*'
+      AND (typeof(credits) <> 'text' OR credits = '')
+"""
+SQL_STUDENT_FILES = (
+    "SELECT s.image_filename, r.research_filename FROM students s "
+    "LEFT JOIN research r ON r.student_id = s.id WHERE s.id=?"
+)
+# حذف الطالب: الجداول الفرعية أولاً ثم الطالب (المفاتيح الأجنبية مفعلة)
+SQL_DELETE_STUDENT = tuple(
+    f"DELETE FROM {t} WHERE student_id=?"
+    for t in ("admission", "courses", "research", "competency", "plan_members", "plan")
+) + ("DELETE FROM students WHERE id=?",)
+
+def _fetch_student_joined(conn: sqlite3.Connection, sql: str, joins, student_id) -> Dict[str, Any]:
+    """
+    تنفيذ استعلام الـ JOIN وتقسيم السطر إلى قاموس لكل جدول
+    (None للجدول الذي لا يملك سجلاً لهذا الطالب، كما كانت تعيده الاستعلامات المنفصلة)
+    """
+    row = conn.execute(sql, (student_id,)).fetchone()
+    if row is None:
+        return {"students": None, **{t: None for t, _, _ in joins}}
+    data = {"students": {k: row[k] for k in row.keys() if "__" not in k}}
+    for t, al, table_cols in joins:
+        if row[f"{al}__student_id"] is None:
+            data[t] = None
+        else:
+            data[t] = {c: row[f"{al}__{c}"] for c in table_cols}
+    return data
+
+# بنك المواد لا يتغير إلا بإضافة مواد جديدة (لا حذف ولا تعديل)، لذا نحفظ القائمة المرتبة في الذاكرة
+# ونستخدم أكبر id كرقم إصدار: استعلامه من الفهرس الأساسي فوري ويكشف الإضافات من العمال الآخرين أيضاً
+_avail_cache: Dict[str, Any] = {"v": None, "data": None}
+_avail_lock = threading.Lock()
+
+def get_available_courses(conn: sqlite3.Connection) -> list:
+    """ قائمة بنك المواد مرتبة بالاسم، من الذاكرة ما لم تُضف مواد جديدة """
+    v = conn.execute(SQL_AVAILABLE_VERSION).fetchone()[0]
+    with _avail_lock:
+        if _avail_cache["data"] is not None and _avail_cache["v"] == v:
+            return _avail_cache["data"]
+    data = conn.execute(SQL_AVAILABLE_COURSES).fetchall()
+    with _avail_lock:
+        _avail_cache["v"], _avail_cache["data"] = v, data
+    return data
+
+def _tune(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """ ضبط إعدادات الاتصال (PRAGMA) مرة واحدة لكل اتصال جديد """
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute("PRAGMA foreign_keys=ON")
+    # حتى يطلق INSERT OR REPLACE تريغر الحذف فيبقى فهرس FTS متزامناً
+    conn.execute("PRAGMA recursive_triggers=ON")
+    # القراءة عبر mmap تتطلب مساحة عناوين كبيرة، لذا على أنظمة 64-bit فقط
+    if sys.maxsize > 2**32:
+        conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+def _connect_and_tune(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False, cached_statements=256)
+    conn.row_factory = sqlite3.Row
+    return _tune(conn)
+
+class ConnectionPool:
+    """
+    مجمع اتصالات SQLite لقاعدة بيانات واحدة
+    LIFO حتى يبقى آخر اتصال مستخدم "ساخناً" بذاكرة الصفحات الخاصة به
+    """
+    def __init__(self, path: str, size: int = 8):
+        self.path = path
+        self._pool: queue.LifoQueue = queue.LifoQueue(maxsize=size)
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return _connect_and_tune(self.path)
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False) -> None:
+        # قد يكون الاتصال في حالة غير سليمة بعد الخطأ، فلا نعيده للمجمع
+        if broken:
+            conn.close()
+            return
+        # إلغاء أي معاملة لم تُحفظ حتى لا تنتقل للطلب التالي
+        conn.rollback()
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, broken=True)
+            raise
+        self.release(conn)
+
+    def drain(self):
+        """ إغلاق جميع الاتصالات المحفوظة (عند إيقاف التطبيق) """
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+_admins_pool = ConnectionPool(ADMINS_DB_PATH)
+_students_pool = ConnectionPool(STUDENTS_DB_PATH)
+atexit.register(_admins_pool.drain)
+atexit.register(_students_pool.drain)
+_REQUEST_POOLS = (("db", _admins_pool), ("students_db", _students_pool))
+
+@contextmanager
+def _request_connection(pool: ConnectionPool, key: str):
+    """
+    اتصال واحد لكل طلب: أول استخدام يأخذه من المجمع ويحفظه في g،
+    وكل الاستعلامات التالية في نفس الطلب تعيد استخدامه حتى يُعاد عند teardown
+    """
+    if not has_app_context():
+        # سكربتات خارج فلاسك: اتصال من المجمع لهذه الكتلة فقط
+        with pool.connection() as conn:
+            yield conn
+        return
+    # [الاتصال, عدد الكتل المفتوحة]: الكتل المتداخلة لا تلغي معاملة الكتلة الخارجية
+    entry = g.get(key)
+    if entry is None:
+        entry = g.setdefault(key, [pool.acquire(), 0])
+    conn = entry[0]
+    entry[1] += 1
+    try:
+        yield conn
+    except BaseException:
+        entry[1] -= 1
+        if entry[1] == 0:
+            g.pop(key, None)
+            pool.release(conn, broken=True)
+        raise
+    entry[1] -= 1
+    if entry[1] == 0:
+        # ما لم يُحفظ داخل الكتلة لا ينتقل إلى الكتلة التالية (كما في المجمع)
+        conn.rollback()
+
+@app.teardown_appcontext
+def _release_request_connections(exc):
+    for key, pool in _REQUEST_POOLS:
+        entry = g.pop(key, None)
+        if entry is not None:
+            pool.release(entry[0], broken=exc is not None)
+
 # --- دوال قاعدة بيانات المشرفين ---
 def get_db():
-    conn = sqlite3.connect(ADMINS_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return _request_connection(_admins_pool, "db")
 
 def init_admins():
     """ إنشاء جدول المشرفين وإضافة المشرف الأساسي """
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS admins (
-            username TEXT PRIMARY KEY,
-            password TEXT NOT NULL,
-            role     TEXT NOT NULL
-        )
-    """)
-    # إضافة حساب admin الافتراضي إذا لم يكن موجوداً
-    cur.execute("SELECT 1 FROM admins WHERE username = ?", ("admin",))
-    if cur.fetchone() is None:
-        hashed_pw = generate_password_hash("admin123")
-        cur.execute(
-            "INSERT INTO admins(username, password, role) VALUES(?,?,?)",
-            ("admin", hashed_pw, "super")
-        )
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        # وضع WAL دائم على ملف القاعدة، يكفي ضبطه مرة واحدة عند التشغيل
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS admins (
+                    username TEXT PRIMARY KEY,
+                    password TEXT NOT NULL,
+                    role     TEXT NOT NULL
+                )
+            """)
+            # إضافة حساب admin الافتراضي إذا لم يكن موجوداً
+            # (الفحص المسبق يوفر كلفة bcrypt عند كل تشغيل، و OR IGNORE يحمي من تسابق العمال)
+            cur.execute("SELECT 1 FROM admins WHERE username = ?", ("admin",))
+            if cur.fetchone() is None:
+                cur.execute(
+                    "INSERT OR IGNORE INTO admins(username, password, role) VALUES(?,?,?)",
+                    ("admin", hash_password("admin123"), "super")
+                )
 
-# --- دوال قاعدة بيانات الطلاب ---
-def get_students_db():
-    conn = sqlite3.connect(STUDENTS_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# جدول المشرفين صغير ونادر التغيير: نسخة كاملة منه في الكاش لتسجيل الدخول وصفحة المشرفين
+ADMINS_CACHE_KEY = "admins:all"
+ADMINS_CACHE_TIMEOUT = 30
 
-def init_students_db():
-    """ إنشاء وتحديث جداول بيانات الطلاب """
-    conn = get_students_db()
-    cur = conn.cursor()
-
-    # 1. جدول المعلومات الشخصية
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS students (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            full_name TEXT NOT NULL,
-            full_name_en TEXT,
-            student_id TEXT UNIQUE NOT NULL,
-            email TEXT,
-            phone TEXT,
-            college TEXT,
-            department TEXT,
-            department_en TEXT,
-            level TEXT,
-            level_en TEXT,
-            study_type TEXT,
-            password TEXT,
-            image_filename TEXT
-        )
-    """)
+def get_admins() -> Dict[str, tuple]:
+    """ {username: (password, role)} مرتبة بالاسم، من الكاش لمدة 30 ثانية أو حتى أي تعديل """
+    admins = cache.get(ADMINS_CACHE_KEY)
+    if admins is None:
+        with get_db() as conn:
+            admins = {r["username"]: (r["password"], r["role"]) for r in conn.execute(SQL_ALL_ADMINS)}
+        cache.set(ADMINS_CACHE_KEY, admins, timeout=ADMINS_CACHE_TIMEOUT)
+    return admins
 
-    # التأكد من وجود الأعمدة الجديدة (Migration)
-    columns = ["full_name_en", "department_en", "level_en", "study_type", "password"]
-    for col in columns:
-        try:
-            cur.execute(f"ALTER TABLE students ADD COLUMN {col} TEXT")
-        except sqlite3.OperationalError:
-            pass
+def invalidate_admins() -> None:
+    cache.delete(ADMINS_CACHE_KEY)
 
-    # 2. جدول القبول
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS admission (
-            student_id INTEGER PRIMARY KEY,
-            type TEXT,
-            year TEXT,
-            avg TEXT,
-            notes TEXT,
-            graduation_date TEXT,
-            FOREIGN KEY (student_id) REFERENCES students (id)
-        )
+# --- دوال قاعدة بيانات الطلاب ---
+def get_students_db():
+    return _request_connection(_students_pool, "students_db")
+
+def _add_missing_columns(cur: sqlite3.Cursor, table: str, columns: List[tuple]) -> None:
+    """ إضافة الأعمدة الناقصة فقط بعد فحص PRAGMA table_info (بدون الاعتماد على الأخطاء) """
+    existing = {r[1] for r in cur.execute(f"PRAGMA table_info({table})")}
+    for col, definition in columns:
+        if col not in existing:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN {col} {definition}")
+
+# البحث النصي عبر FTS5 بمقسّم trigram: يطابق أي جزء من النص مثل LIKE '%q%' لكن من فهرس
+# (يحتاج 3 أحرف على الأقل؛ الأقصر يرجع إلى LIKE). يتفعل فقط إن دعمته نسخة SQLite
+FTS_MIN_CHARS = 3
+_fts_ready = False
+
+def _create_fts(cur: sqlite3.Cursor, name: str, table: str, key: str, columns: List[str]) -> None:
+    """ إنشاء جدول FTS5 يعكس أعمدة جدول أصلي، مع Triggers لمزامنته وبنائه أول مرة """
+    exists = cur.execute("SELECT 1 FROM sqlite_master WHERE name=?", (name,)).fetchone()
+    cols = ", ".join(columns)
+    new_cols = ", ".join(f"new.{c}" for c in columns)
+    old_cols = ", ".join(f"old.{c}" for c in columns)
+    cur.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5("
+        f"{cols}, content='{table}', content_rowid='{key}', tokenize='trigram')"
+    )
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {name}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {name}(rowid, {cols}) VALUES (new.{key}, {new_cols});
+        END
     """)
-    try:
-        cur.execute("ALTER TABLE admission ADD COLUMN graduation_date TEXT")
-    except sqlite3.OperationalError:
-        pass
-
-    # 3. جدول المواد الدراسية
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS courses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            student_id INTEGER,
-            course_name TEXT,
-            semester TEXT,
-            credits INTEGER,
-            coursework_total REAL DEFAULT 0,
-            coursework_breakdown TEXT DEFAULT '[]',
-            final_exam REAL DEFAULT 0,
-            grade TEXT DEFAULT '0',
-            FOREIGN KEY (student_id) REFERENCES students (id)
-        )
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {name}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.{key}, {old_cols});
+        END
     """)
-    # إضافة أعمدة الدرجات التفصيلية إذا لم تكن موجودة
-    course_cols = [
-        ("coursework_total", "REAL DEFAULT 0"),
-        ("coursework_breakdown", "TEXT DEFAULT '[]'"),
-        ("final_exam", "REAL DEFAULT 0"),
-        ("grade", "TEXT DEFAULT '0'")
-    ]
-    for col, definition in course_cols:
-        try:
-            cur.execute(f"ALTER TABLE courses ADD COLUMN {col} {definition}")
-        except sqlite3.OperationalError:
-            pass
-
-    # 4. جدول البحث والمشروع
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS research (
-            student_id INTEGER PRIMARY KEY,
-            title TEXT,
-            supervisor TEXT,
-            start_date TEXT,
-            keywords TEXT,
-            abstract TEXT,
-            research_filename TEXT,
-            credits INTEGER DEFAULT 0,
-            grade TEXT,
-            FOREIGN KEY (student_id) REFERENCES students (id)
-        )
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {name}_au AFTER UPDATE OF {cols} ON {table} BEGIN
+            INSERT INTO {name}({name}, rowid, {cols}) VALUES ('delete', old.{key}, {old_cols});
+            INSERT INTO {name}(rowid, {cols}) VALUES (new.{key}, {new_cols});
+        END
     """)
-    for stmt in [
-        "ALTER TABLE research ADD COLUMN research_filename TEXT",
-        "ALTER TABLE research ADD COLUMN credits INTEGER DEFAULT 0",
-        "ALTER TABLE research ADD COLUMN grade TEXT"
-    ]:
-        try:
-            cur.execute(stmt)
-        except sqlite3.OperationalError:
-            pass
+    if not exists:
+        cur.execute(f"INSERT INTO {name}({name}) VALUES ('rebuild')")
 
-    # 5. جدول الامتحان الشامل والكفاءة
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS competency (
-            student_id INTEGER PRIMARY KEY,
-            exam_result TEXT,
-            exam_date TEXT,
-            english_result TEXT,
-            notes TEXT,
-            FOREIGN KEY (student_id) REFERENCES students (id)
-        )
-    """)
+def _search_clause(q: str, fts: str, key: str, columns: List[tuple]) -> tuple:
+    """
+    شرط بحث (SQL, params) على أعمدة [(عمود FTS, تعبير الجدول الأصلي)]:
+    MATCH على جدول FTS إن أمكن، وإلا LIKE كما كان سابقاً
+    """
+    if _fts_ready and len(q) >= FTS_MIN_CHARS:
+        cols = " ".join(c for c, _ in columns)
+        phrase = '"' + q.replace('"', '""') + '"'
+        return (f"{key} IN (SELECT rowid FROM {fts} WHERE {fts} MATCH ?)",
+                [f"{{{cols}}} : {phrase}"])
+    return ("(" + " OR ".join(f"{expr} LIKE ?" for _, expr in columns) + ")",
+            [f"%{q}%"] * len(columns))
 
-    # 6. جدول لجنة المناقشة
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS plan (
-            student_id INTEGER PRIMARY KEY,
-            committee_name TEXT,
-            supervisor TEXT,
-            members TEXT,
-            discussion_date TEXT,
-            notes TEXT,
-            FOREIGN KEY (student_id) REFERENCES students (id)
-        )
-    """)
+def init_students_db():
+    """ إنشاء وتحديث جداول بيانات الطلاب """
+    global _fts_ready
+    with get_students_db() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
 
-    # 7. جدول بنك المواد (Available Courses)
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS available_courses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            course_name TEXT UNIQUE,
-            default_credits INTEGER DEFAULT 3
-        )
-    """)
+        # كل عمليات الإنشاء والترحيل ضمن معاملة واحدة (مزامنة واحدة للقرص)
+        with conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN")
+
+            # 1. جدول المعلومات الشخصية
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS students (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    full_name TEXT NOT NULL,
+                    full_name_en TEXT,
+                    student_id TEXT UNIQUE NOT NULL,
+                    email TEXT,
+                    phone TEXT,
+                    college TEXT,
+                    department TEXT,
+                    department_en TEXT,
+                    level TEXT,
+                    level_en TEXT,
+                    study_type TEXT,
+                    password TEXT,
+                    image_filename TEXT
+                )
+            """)
+
+            # التأكد من وجود الأعمدة الجديدة (Migration)
+            _add_missing_columns(cur, "students", [
+                ("full_name_en", "TEXT"),
+                ("department_en", "TEXT"),
+                ("level_en", "TEXT"),
+                ("study_type", "TEXT"),
+                ("password", "TEXT"),
+                ("level_code", "INTEGER")
+            ])
+            # رمز المرحلة يُحسب من النص عبر Triggers، حتى تعتمد الإحصائيات على مقارنة = بدل LIKE
+            cur.execute(
+                "UPDATE students SET level_code = " + _LEVEL_CODE_EXPR.format(col="level") +
+                " WHERE level_code IS NULL"
+            )
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_students_level_code_ins AFTER INSERT ON students
+                BEGIN
+                    UPDATE students SET level_code = {_LEVEL_CODE_EXPR.format(col="NEW.level")} WHERE id = NEW.id;
+                END
+            """)
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_students_level_code_upd AFTER UPDATE OF level ON students
+                BEGIN
+                    UPDATE students SET level_code = {_LEVEL_CODE_EXPR.format(col="NEW.level")} WHERE id = NEW.id;
+                END
+            """)
+            # فهرس ضيق يغطي إحصائيات لوحة التحكم
+            cur.execute("DROP INDEX IF EXISTS idx_students_level_type")
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_students_levelcode ON students(level_code, study_type)")
+
+            # 2. جدول القبول
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS admission (
+                    student_id INTEGER PRIMARY KEY,
+                    type TEXT,
+                    year TEXT,
+                    avg TEXT,
+                    notes TEXT,
+                    graduation_date TEXT,
+                    FOREIGN KEY (student_id) REFERENCES students (id)
+                )
+            """)
+            _add_missing_columns(cur, "admission", [("graduation_date", "TEXT")])
+
+            # 3. جدول المواد الدراسية
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS courses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    student_id INTEGER,
+                    course_name TEXT,
+                    semester TEXT,
+                    credits INTEGER,
+                    coursework_total REAL DEFAULT 0,
+                    coursework_breakdown TEXT DEFAULT '[]',
+                    final_exam REAL DEFAULT 0,
+                    grade TEXT DEFAULT '0',
+                    FOREIGN KEY (student_id) REFERENCES students (id)
+                )
+            """)
+            # إضافة أعمدة الدرجات التفصيلية إذا لم تكن موجودة
+            _add_missing_columns(cur, "courses", [
+                ("coursework_total", "REAL DEFAULT 0"),
+                ("coursework_breakdown", "TEXT DEFAULT '[]'"),
+                ("final_exam", "REAL DEFAULT 0"),
+                ("grade", "TEXT DEFAULT '0'")
+            ])
+            cur.execute("CREATE INDEX IF NOT EXISTS idx_courses_student ON courses(student_id)")
+            # توحيد درجات السعي القديمة (مسافات، كسور مثل 5.0، نصوص) إلى صيغة مضغوطة من الأرقام حتى تُقرأ بدون تحويل
+            legacy = cur.execute(
+                "SELECT id, coursework_breakdown FROM courses "
+                "WHERE coursework_breakdown GLOB '*[. \"eE]*' OR coursework_breakdown NOT GLOB '[[]*'"
+            ).fetchall()
+            fixes = []
+            for cid, raw in legacy:
+                marks = _parse_breakdown(raw, strict=True)
+                # النص التالف يبقى كما هو: لا نحفظ أبداً قائمة أقصر من الأصل
+                if marks is None:
+                    continue
+                norm = json_dumps(marks)
+                if norm != raw:
+                    fixes.append((norm, cid))
+            cur.executemany("UPDATE courses SET coursework_breakdown=? WHERE id=?", fixes)
+
+            # 4. جدول البحث والمشروع
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS research (
+                    student_id INTEGER PRIMARY KEY,
+                    title TEXT,
+                    supervisor TEXT,
+                    start_date TEXT,
+                    keywords TEXT,
+                    abstract TEXT,
+                    research_filename TEXT,
+                    credits INTEGER DEFAULT 0,
+                    grade TEXT,
+                    FOREIGN KEY (student_id) REFERENCES students (id)
+                )
+            """)
+            _add_missing_columns(cur, "research", [
+                ("research_filename", "TEXT"),
+                ("credits", "INTEGER DEFAULT 0"),
+                ("grade", "TEXT")
+            ])
+
+            # 5. جدول الامتحان الشامل والكفاءة
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS competency (
+                    student_id INTEGER PRIMARY KEY,
+                    exam_result TEXT,
+                    exam_date TEXT,
+                    english_result TEXT,
+                    notes TEXT,
+                    FOREIGN KEY (student_id) REFERENCES students (id)
+                )
+            """)
+
+            # 6. جدول لجنة المناقشة
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS plan (
+                    student_id INTEGER PRIMARY KEY,
+                    committee_name TEXT,
+                    supervisor TEXT,
+                    members TEXT,
+                    discussion_date TEXT,
+                    notes TEXT,
+                    FOREIGN KEY (student_id) REFERENCES students (id)
+                )
+            """)
+
+            # أعضاء اللجنة: سطر لكل عضو بدلاً من نص مفصول بفواصل في plan.members
+            has_members = cur.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='plan_members'"
+            ).fetchone()
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS plan_members (
+                    student_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    PRIMARY KEY (student_id, name),
+                    FOREIGN KEY (student_id) REFERENCES students (id)
+                )
+            """)
+            if not has_members:
+                # نقل الأعضاء من العمود القديم مرة واحدة، بنفس ترتيبهم
+                old_rows = cur.execute(
+                    "SELECT student_id, members FROM plan "
+                    "WHERE members <> '' AND student_id IN (SELECT id FROM students)"
+                ).fetchall()
+                cur.executemany(SQL_ADD_PLAN_MEMBER, [
+                    (sid, m.strip()) for sid, members in old_rows for m in members.split(",") if m.strip()
+                ])
+
+            # 7. جدول بنك المواد (Available Courses)
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS available_courses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    course_name TEXT UNIQUE,
+                    default_credits INTEGER DEFAULT 3
+                )
+            """)
+            # فهرس مغطٍ لقائمة المواد المرتبة حسب الاسم (بدون الرجوع للجدول)
+            cur.execute(
+                "CREATE INDEX IF NOT EXISTS idx_available_courses_name "
+                "ON available_courses(course_name, default_credits)"
+            )
 
-    cur.execute("SELECT COUNT(*) FROM available_courses")
-    if cur.fetchone()[0] == 0:
-        default_courses = [
-            ("رسم بالحاسوب", 3), ("معمارية حاسوب", 3), ("لغة إنكليزية", 2),
-            ("ذكاء اصطناعي", 3), ("أمنية بيانات", 3), ("نظم تشغيل", 3),
-            ("تحليل خوارزميات", 3), ("معالجة صور", 3), ("شبكات عصبية", 3)
-        ]
-        cur.executemany(
-            "INSERT OR IGNORE INTO available_courses (course_name, default_credits) VALUES (?, ?)",
-            default_courses
-        )
+            # المواد الافتراضية عند إنشاء البنك فقط: مع AUTOINCREMENT يستهلك كل INSERT OR IGNORE
+            # أرقاماً من sqlite_sequence حتى لو تجاوز الصف، فلا نكرره مع كل تشغيل للعمال
+            if cur.execute("SELECT 1 FROM available_courses LIMIT 1").fetchone() is None:
+                default_courses = [
+                    ("رسم بالحاسوب", 3), ("معمارية حاسوب", 3), ("لغة إنكليزية", 2),
+                    ("ذكاء اصطناعي", 3), ("أمنية بيانات", 3), ("نظم تشغيل", 3),
+                    ("تحليل خوارزميات", 3), ("معالجة صور", 3), ("شبكات عصبية", 3)
+                ]
+                cur.executemany(
+                    "INSERT OR IGNORE INTO available_courses (course_name, default_credits) VALUES (?, ?)",
+                    default_courses
+                )
 
-    conn.commit()
-    conn.close()
+            # 8. فهارس البحث النصي للأسماء وعناوين البحوث
+            try:
+                _create_fts(cur, "students_fts", "students", "id", ["full_name", "student_id"])
+                _create_fts(cur, "research_fts", "research", "student_id", ["title", "supervisor", "start_date"])
+                _fts_ready = True
+            except sqlite3.OperationalError:
+                # نسخة SQLite بدون FTS5 أو بدون trigram (أقدم من 3.34): نبقى على LIKE
+                _fts_ready = False
+
+        # إحصائيات الفهارس حتى يختارها مخطط الاستعلامات: ANALYZE كامل مرة واحدة فقط،
+        # وبعدها PRAGMA optimize الذي لا يعيد التحليل إلا للجداول التي تغيرت كثيراً
+        has_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sqlite_stat1'"
+        ).fetchone()
+        conn.execute("PRAGMA optimize" if has_stats else "ANALYZE")
+
+# تهيئة قواعد البيانات عند أول طلب بدلاً من وقت الاستيراد، حتى لا يتأخر إقلاع العمال
+# قفل الملف يضمن أن عاملاً واحداً فقط ينفذ الترحيل بينما ينتظر الباقون
+_init_done = False
+_init_lock = threading.Lock()
+INIT_LOCK_PATH = os.path.join(BASE_DIR, ".init.lock")
 
-# تهيئة قواعد البيانات عند بدء التشغيل
-with app.app_context():
-    init_admins()
-    init_students_db()
+@app.before_request
+def _ensure_init():
+    global _init_done
+    if _init_done:
+        return
+    with _init_lock, open(INIT_LOCK_PATH, "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not _init_done:
+            init_admins()
+            init_students_db()
+            _init_done = True
 
 
 # ========================================================
 #  أدوات التحقق من الصلاحيات (Decorators)
 # ========================================================
 
+# أدوار الإدارة المسموح لها بدخول صفحات المشرفين
+_ADMIN_ROLES = frozenset(("super", "admin"))
+
 def login_required(f):
     """ يمنع الدخول للصفحات المحمية إلا بعد تسجيل الدخول """
     @wraps(f)
     def wrapper(*args, **kwargs):
-        if "user" not in session:
+        user = session.get("user")
+        if not user:
             return redirect(url_for("login"))
+        # نقرأ الجلسة مرة واحدة ونحفظ ما تحتاجه صفحات المعالج في g
+        g.user_role = user.get("role")
+        g.student_id = session.get("student_id")
+        return f(*args, **kwargs)
+    return wrapper
+
+def not_student(f):
+    """ يعيد الطالب إلى بوابته بدلاً من صفحات معالج الإدخال (يأتي بعد login_required) """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if g.user_role == "student":
+            return redirect(url_for("student_portal"))
         return f(*args, **kwargs)
     return wrapper
 
+def student_required(f):
+    """
+    صفحات المعالج تحتاج طالباً محدداً في الجلسة (يأتي بعد login_required)
+    وقد يكون مشرف آخر حذفه، فنعيد إلى صفحة البيانات بدلاً من فشل الإدخال بالمفتاح الخارجي
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        sid = g.student_id
+        if sid:
+            with get_students_db() as conn:
+                if conn.execute(SQL_STUDENT_EXISTS, (sid,)).fetchone():
+                    return f(*args, **kwargs)
+            session.pop("student_id", None)
+            g.student_id = None
+        return redirect(url_for("info"))
+    return wrapper
+
 def admin_only(f):
     """ يمنع الطلاب من دخول صفحات الإدارة """
     @wraps(f)
     def wrapper(*args, **kwargs):
         u = session.get("user")
-        if not u or u.get("role") not in {"super", "admin"}:
+        if not u or u.get("role") not in _ADMIN_ROLES:
             abort(403)
         return f(*args, **kwargs)
     return wrapper
@@ -336,8 +1043,11 @@ def admin_only(f):
 
 @app.route('/favicon.ico')
 def favicon():
-    """ أيقونة الموقع """
-    return send_file(os.path.join(app.static_folder, 'ku.ico'), mimetype='image/vnd.microsoft.icon')
+    """ أيقونة الموقع (مع تخزين مؤقت لمدة سنة في المتصفح) """
+    return send_from_directory(
+        app.static_folder, 'ku.ico',
+        mimetype='image/vnd.microsoft.icon', max_age=31536000
+    )
 
 @app.route("/")
 def home():
@@ -352,41 +1062,46 @@ def login():
         username = (request.form.get("username") or "").strip()
         password = (request.form.get("password") or "").strip()
 
+        # حقل فارغ لا يطابق أي حساب: نرفضه مباشرة بدون استعلام أو تشفير
+        has_input = bool(username and password)
+
         # 1. التحقق من المشرفين
-        conn = get_db()
-        admin_row = conn.execute(
-            "SELECT username, password, role FROM admins WHERE username=?",
-            (username,)
-        ).fetchone()
-        conn.close()
+        admin_row = get_admins().get(username) if has_input else None
 
-        if admin_row and check_password_hash(admin_row["password"], password):
-            session["user"] = {"username": admin_row["username"], "role": admin_row["role"]}
+        if admin_row and verify_password(admin_row[0], password):
+            if password_needs_rehash(admin_row[0]):
+                with get_db() as conn:
+                    conn.execute(SQL_SET_ADMIN_PASSWORD, (hash_password(password), username))
+                    conn.commit()
+                invalidate_admins()
+            start_user_session({"username": username, "role": admin_row[1]})
             return redirect(url_for("dashboard"))
 
         # 2. التحقق من الطلاب
-        conn_s = get_students_db()
-        student_row = conn_s.execute(
-            "SELECT id, full_name, student_id, password FROM students WHERE student_id=?",
-            (username,)
-        ).fetchone()
-        conn_s.close()
+        student_row = None
+        if has_input:
+            with get_students_db() as conn_s:
+                student_row = conn_s.execute(SQL_LOGIN_STUDENT, (username,)).fetchone()
 
         valid_student = False
         if student_row:
             db_pass = student_row["password"]
             if db_pass and len(db_pass) > 20:
-                if check_password_hash(db_pass, password):
+                if verify_password(db_pass, password):
                     valid_student = True
-            elif password == student_row["student_id"]:
+                    if password_needs_rehash(db_pass):
+                        with get_students_db() as conn_s:
+                            conn_s.execute(SQL_SET_STUDENT_PASSWORD, (hash_password(password), student_row["id"]))
+                            conn_s.commit()
+            elif same_secret(password, student_row["student_id"]):
                 valid_student = True
 
         if valid_student:
-            session["user"] = {
+            start_user_session({
                 "username": student_row["full_name"],
                 "role": "student",
                 "db_id": student_row["id"]
-            }
+            })
             flash(f"أهلاً بك {student_row['full_name']}", "success")
             return redirect(url_for("student_portal"))
 
@@ -419,38 +1134,22 @@ def student_portal():
         return redirect(url_for("dashboard"))
 
     student_db_id = session["user"]["db_id"]
-    conn = get_students_db()
-
-    student_info = conn.execute(
-        "SELECT full_name, student_id, college, department FROM students WHERE id=?",
-        (student_db_id,)
-    ).fetchone()
-    raw_courses = conn.execute(
-        "SELECT course_name, semester, credits, coursework_total, final_exam, grade, coursework_breakdown "
-        "FROM courses WHERE student_id=?",
-        (student_db_id,)
-    ).fetchall()
-    conn.close()
-
-    courses = []
-    for c in raw_courses:
-        course_dict = dict(c)
-        try:
-            breakdown = json.loads(c["coursework_breakdown"] or "[]")
-            clean_breakdown = []
-            for mark in breakdown:
-                try:
-                    val = float(mark)
-                    if val.is_integer():
-                        clean_breakdown.append(int(val))
-                    else:
-                        clean_breakdown.append(val)
-                except:
-                    clean_breakdown.append(0)
-            course_dict["coursework_breakdown"] = clean_breakdown
-        except:
-            course_dict["coursework_breakdown"] = []
-        courses.append(course_dict)
+    # بيانات البوابة لكل طالب على حدة (الرسائل المؤقتة flash خارج الكاش لأنها تُعرض في القالب)
+    key = _portal_cache_key(student_db_id)
+    cached = cache.get(key)
+    if cached is None:
+        with get_students_db() as conn:
+            student_info = conn.execute(SQL_PORTAL_INFO, (student_db_id,)).fetchone()
+            raw_courses = conn.execute(SQL_PORTAL_COURSES, (student_db_id,)).fetchall()
+
+        courses = []
+        for c in raw_courses:
+            course_dict = dict(zip(_COURSE_COLS, c))
+            course_dict["coursework_breakdown"] = _parse_breakdown(c["coursework_breakdown"])
+            courses.append(course_dict)
+        cached = (dict(student_info) if student_info else None, courses)
+        cache.set(key, cached, timeout=PORTAL_CACHE_TIMEOUT)
+    student_info, courses = cached
 
     return render_template("student_portal.html", student=student_info, courses=courses)
 
@@ -468,33 +1167,28 @@ def student_change_password():
         return redirect(url_for("student_portal"))
 
     student_db_id = session["user"]["db_id"]
-    conn = get_students_db()
-    row = conn.execute(
-        "SELECT student_id, password FROM students WHERE id=?",
-        (student_db_id,)
-    ).fetchone()
-
-    if not row:
-        conn.close()
-        return redirect(url_for("logout"))
-
-    current_db_pass = row["password"]
-    is_old_valid = False
-    if current_db_pass and len(current_db_pass) > 20:
-        if check_password_hash(current_db_pass, old_pass):
+    with get_students_db() as conn:
+        row = conn.execute(SQL_STUDENT_PASSWORD, (student_db_id,)).fetchone()
+
+        if not row:
+            return redirect(url_for("logout"))
+
+        current_db_pass = row["password"]
+        is_old_valid = False
+        if current_db_pass and len(current_db_pass) > 20:
+            if verify_password(current_db_pass, old_pass):
+                is_old_valid = True
+        elif same_secret(old_pass, row["student_id"]):
             is_old_valid = True
-    elif old_pass == row["student_id"]:
-        is_old_valid = True
 
-    if not is_old_valid:
-        flash("كلمة المرور الحالية غير صحيحة", "error")
-        conn.close()
-        return redirect(url_for("student_portal"))
+        if not is_old_valid:
+            flash("كلمة المرور الحالية غير صحيحة", "error")
+            return redirect(url_for("student_portal"))
 
-    new_hashed = generate_password_hash(new_pass)
-    conn.execute("UPDATE students SET password = ? WHERE id = ?", (new_hashed, student_db_id))
-    conn.commit()
-    conn.close()
+        new_hashed = hash_password(new_pass)
+        conn.execute(SQL_SET_STUDENT_PASSWORD, (new_hashed, student_db_id))
+        conn.commit()
+    invalidate_portal(student_db_id)
     flash("تم تغيير كلمة المرور بنجاح", "success")
     return redirect(url_for("student_portal"))
 
@@ -507,53 +1201,51 @@ def student_change_password():
 @login_required
 @admin_only
 def dashboard():
-    conn = get_students_db()
-    cur = conn.cursor()
-    total = cur.execute("SELECT COUNT(*) FROM students").fetchone()[0]
-    master = cur.execute("SELECT COUNT(*) FROM students WHERE level LIKE '%ماجستير%'").fetchone()[0]
-    phd = cur.execute("SELECT COUNT(*) FROM students WHERE level LIKE '%دكتوراه%'").fetchone()[0]
-    morning = cur.execute("SELECT COUNT(*) FROM students WHERE study_type = 'صباحي'").fetchone()[0]
-    evening = cur.execute("SELECT COUNT(*) FROM students WHERE study_type = 'مسائي'").fetchone()[0]
-    conn.close()
-    return render_template(
-        "dashboard.html",
-        user=session.get("user"),
-        stats={"total": total, "master": master, "phd": phd, "morning": morning, "evening": evening}
-    )
+    # جميع الإحصائيات من استعلام تجميع واحد على الفهرس (level_code, study_type)
+    stats = {"total": 0, "master": 0, "phd": 0, "morning": 0, "evening": 0}
+    with get_students_db() as conn:
+        for level_code, study_type, n in conn.execute(SQL_DASHBOARD_STATS):
+            stats["total"] += n
+            if level_code == LEVEL_MASTER:
+                stats["master"] += n
+            elif level_code == LEVEL_PHD:
+                stats["phd"] += n
+            if study_type == 'صباحي':
+                stats["morning"] += n
+            elif study_type == 'مسائي':
+                stats["evening"] += n
+    return render_template("dashboard.html", user=session.get("user"), stats=stats)
 
 @app.route("/admins", methods=["GET", "POST"])
 @login_required
 @admin_only
 def admins():
-    conn = get_db()
-    cur = conn.cursor()
     if request.method == "POST":
-        action = request.form.get("action")
-        if action == "add":
-            username = (request.form.get("new_username") or "").strip()
-            password = (request.form.get("new_password") or "").strip()
-            role = (request.form.get("new_role") or "admin").strip()
-            if username and password:
-                try:
-                    hashed_pw = generate_password_hash(password)
-                    cur.execute(
-                        "INSERT INTO admins(username,password,role) VALUES(?,?,?)",
-                        (username, hashed_pw, role)
-                    )
+        with get_db() as conn:
+            cur = conn.cursor()
+            action = request.form.get("action")
+            if action == "add":
+                username = (request.form.get("new_username") or "").strip()
+                password = (request.form.get("new_password") or "").strip()
+                role = (request.form.get("new_role") or "admin").strip()
+                if username and password:
+                    try:
+                        hashed_pw = hash_password(password)
+                        cur.execute(SQL_ADD_ADMIN, (username, hashed_pw, role))
+                        conn.commit()
+                        flash("تمت الإضافة", "success")
+                    except sqlite3.IntegrityError:
+                        flash("المستخدم موجود", "error")
+            elif action == "delete":
+                username = (request.form.get("username") or "").strip()
+                if username != "admin" and username != session['user']['username']:
+                    cur.execute(SQL_DELETE_ADMIN, (username,))
                     conn.commit()
-                    flash("تمت الإضافة", "success")
-                except sqlite3.IntegrityError:
-                    flash("المستخدم موجود", "error")
-        elif action == "delete":
-            username = (request.form.get("username") or "").strip()
-            if username != "admin" and username != session['user']['username']:
-                cur.execute("DELETE FROM admins WHERE username = ?", (username,))
-                conn.commit()
-                flash("تم الحذف", "success")
-            else:
-                flash("لا يمكن حذف هذا الحساب", "error")
-    admins_list = cur.execute("SELECT username, role FROM admins ORDER BY username").fetchall()
-    conn.close()
+                    flash("تم الحذف", "success")
+                else:
+                    flash("لا يمكن حذف هذا الحساب", "error")
+        invalidate_admins()
+    admins_list = [{"username": u, "role": role} for u, (_, role) in get_admins().items()]
     return render_template("admins.html", admins=admins_list)
 
 
@@ -563,10 +1255,8 @@ def admins():
 
 @app.route("/info", methods=["GET", "POST"])
 @login_required
+@not_student
 def info():
-    if session["user"].get("role") == "student":
-        return redirect(url_for("student_portal"))
-
     if request.method == "POST":
         full_name = (request.form.get("full_name") or "").strip()
         student_id_input = (request.form.get("student_id") or "").strip()
@@ -578,209 +1268,173 @@ def info():
         f = request.files.get("student_image")
         fname = ""
         if f and f.filename and allowed_file(f.filename):
-            fname = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{f.filename}"
+            fname = f"{time.strftime('%Y%m%d_%H%M%S')}_{f.filename}"
 
         try:
-            conn = get_students_db()
-            cur = conn.cursor()
-            sid = session.get("student_id")
+            with get_students_db() as conn:
+                cur = conn.cursor()
+                sid = g.student_id
 
-            if sid:
-                cur.execute(
-                    """UPDATE students SET full_name=?, full_name_en=?, student_id=?, email=?, phone=?, college=?,
-                       department=?, department_en=?, level=?, level_en=?, study_type=?,
-                       image_filename=COALESCE(?, image_filename)
-                       WHERE id=?""",
-                    (full_name, request.form.get("full_name_en"), student_id_input, request.form.get("email"),
-                     request.form.get("phone"), request.form.get("college"), request.form.get("department"),
-                     request.form.get("department_en"), request.form.get("level"), request.form.get("level_en"),
-                     request.form.get("study_type"), fname if fname else None, sid)
-                )
-            else:
-                cur.execute(
-                    """INSERT INTO students (full_name, full_name_en, student_id, email, phone, college, department,
-                       department_en, level, level_en, study_type, image_filename)
-                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                    (full_name, request.form.get("full_name_en"), student_id_input, request.form.get("email"),
-                     request.form.get("phone"), request.form.get("college"), request.form.get("department"),
-                     request.form.get("department_en"), request.form.get("level"), request.form.get("level_en"),
-                     request.form.get("study_type"), fname)
-                )
-                sid = cur.lastrowid
+                if sid:
+                    cur.execute(
+                        SQL_UPDATE_STUDENT_INFO,
+                        (full_name, request.form.get("full_name_en"), student_id_input, request.form.get("email"),
+                         request.form.get("phone"), request.form.get("college"), request.form.get("department"),
+                         request.form.get("department_en"), request.form.get("level"), request.form.get("level_en"),
+                         request.form.get("study_type"), fname if fname else None, sid)
+                    )
+                else:
+                    cur.execute(
+                        SQL_INSERT_STUDENT_INFO,
+                        (full_name, request.form.get("full_name_en"), student_id_input, request.form.get("email"),
+                         request.form.get("phone"), request.form.get("college"), request.form.get("department"),
+                         request.form.get("department_en"), request.form.get("level"), request.form.get("level_en"),
+                         request.form.get("study_type"), fname)
+                    )
+                    sid = cur.lastrowid
 
-            if fname and f:
-                f.save(os.path.join(app.config["UPLOAD_FOLDER"], fname))
+                if fname and f:
+                    save_upload(f, fname)
 
-            conn.commit()
-            conn.close()
+                conn.commit()
+            invalidate_portal(sid)
             session["student_id"] = sid
             return redirect(url_for("admission"))
 
         except sqlite3.IntegrityError:
-            try:
-                conn.close()
-            except:
-                pass
             flash("الرقم الجامعي مسجل مسبقاً", "error")
             return redirect(url_for("info"))
 
-    sid = session.get("student_id")
-    data = {}
+    sid = g.student_id
+    row = None
     if sid:
-        conn = get_students_db()
-        row = conn.execute("SELECT * FROM students WHERE id=?", (sid,)).fetchone()
-        conn.close()
-        if row:
-            data = dict(row)
-    return render_template("info.html", data=data)
+        with get_students_db() as conn:
+            row = conn.execute(SQL_GET_STUDENT, (sid,)).fetchone()
+    # Jinja يقرأ sqlite3.Row بأسماء الأعمدة مباشرة، فلا حاجة لنسخه إلى dict
+    return render_template("info.html", data=row or {})
 
 @app.route("/admission", methods=["GET", "POST"])
 @login_required
+@not_student
+@student_required
 def admission():
-    if session["user"].get("role") == "student":
-        return redirect(url_for("student_portal"))
-    sid = session.get("student_id")
-    if not sid:
-        return redirect(url_for("info"))
+    sid = g.student_id
 
-    conn = get_students_db()
-    if request.method == "POST":
-        conn.execute(
-            "INSERT OR REPLACE INTO admission (student_id, type, year, avg, notes, graduation_date) VALUES (?, ?, ?, ?, ?, ?)",
-            (sid, request.form.get("type"), request.form.get("year"), request.form.get("avg"),
-             request.form.get("notes"), request.form.get("graduation_date"))
-        )
-        conn.commit()
-        conn.close()
-        return redirect(url_for("courses"))
+    with get_students_db() as conn:
+        if request.method == "POST":
+            conn.execute(
+                SQL_SAVE_ADMISSION,
+                (sid, request.form.get("type"), request.form.get("year"), request.form.get("avg"),
+                 request.form.get("notes"), request.form.get("graduation_date"))
+            )
+            conn.commit()
+            return redirect(url_for("courses"))
 
-    row = conn.execute("SELECT * FROM admission WHERE student_id=?", (sid,)).fetchone()
-    conn.close()
-    return render_template("admission.html", data=dict(row) if row else {})
+        row = conn.execute(SQL_GET_ADMISSION, (sid,)).fetchone()
+    return render_template("admission.html", data=row or {})
 
 @app.route("/courses", methods=["GET", "POST"])
 @login_required
+@not_student
+@student_required
 def courses():
-    if session["user"].get("role") == "student":
-        return redirect(url_for("student_portal"))
-    sid = session.get("student_id")
-    if not sid:
-        return redirect(url_for("info"))
-
-    conn = get_students_db()
-    if request.method == "POST":
-        if request.form.get("action") == "delete":
-            cid = safe_int(request.form.get("course_id", -1))
-            if cid > 0:
-                conn.execute("DELETE FROM courses WHERE id=? AND student_id=?", (cid, sid))
-                conn.commit()
-                flash("تم حذف المادة", "success")
-        else:
-            names = request.form.getlist("course_name[]")
-            semesters = request.form.getlist("course_term[]")
-            credits_list = request.form.getlist("course_units[]")
-
-            for i in range(len(names)):
-                c_name = (names[i] or "").strip()
-                if c_name:
-                    c_cred = safe_int(credits_list[i]) if i < len(credits_list) else 0
-
-                    conn.execute(
-                        "INSERT INTO courses (student_id, course_name, semester, credits) VALUES (?, ?, ?, ?)",
-                        (sid, c_name, (semesters[i].strip() if i < len(semesters) else ""), c_cred)
-                    )
-
-                    try:
+    sid = g.student_id
+
+    with get_students_db() as conn:
+        if request.method == "POST":
+            if request.form.get("action") == "delete":
+                cid = safe_int(request.form.get("course_id", -1))
+                if cid > 0:
+                    conn.execute(SQL_DELETE_COURSE, (cid, sid))
+                    conn.commit()
+                    invalidate_portal(sid)
+                    flash("تم حذف المادة", "success")
+            else:
+                names = request.form.getlist("course_name[]")
+                semesters = request.form.getlist("course_term[]")
+                credits_list = request.form.getlist("course_units[]")
+
+                course_rows, avail_rows = [], []
+                for i in range(len(names)):
+                    c_name = (names[i] or "").strip()
+                    if c_name:
+                        c_cred = safe_int(credits_list[i]) if i < len(credits_list) else 0
+                        course_rows.append((sid, c_name, (semesters[i].strip() if i < len(semesters) else ""), c_cred))
+                        avail_rows.append((c_name, c_cred))
+
+                # كل المواد في معاملة واحدة بدلاً من معاملة لكل سطر
+                with conn:
+                    conn.executemany(SQL_ADD_COURSE, course_rows)
+                    # بنك المواد بجملة واحدة متعددة القيم بدلاً من جملة لكل مادة
+                    for i in range(0, len(avail_rows), SQL_MAX_VALUES_ROWS):
+                        chunk = avail_rows[i:i + SQL_MAX_VALUES_ROWS]
                         conn.execute(
-                            "INSERT OR IGNORE INTO available_courses (course_name, default_credits) VALUES (?, ?)",
-                            (c_name, c_cred)
+                            SQL_ADD_AVAILABLE + ",".join(["(?, ?)"] * len(chunk)),
+                            [v for row in chunk for v in row]
                         )
-                    except:
-                        pass
-
-            conn.commit()
+                with _avail_lock:
+                    _avail_cache["data"] = None
+                invalidate_portal(sid)
 
-        conn.close()
-        return redirect(url_for("research"))
+            return redirect(url_for("research"))
 
-    clist = conn.execute("SELECT * FROM courses WHERE student_id=?", (sid,)).fetchall()
-    all_courses = conn.execute(
-        "SELECT course_name, default_credits FROM available_courses ORDER BY course_name"
-    ).fetchall()
+        clist = conn.execute(SQL_GET_COURSES, (sid,)).fetchall()
+        all_courses = get_available_courses(conn)
 
-    processed = []
-    for c in clist:
-        d = dict(c)
-        try:
-            d['coursework_breakdown'] = json.loads(c['coursework_breakdown'] or '[]')
-        except:
-            d['coursework_breakdown'] = []
-        processed.append(d)
-
-    conn.close()
+    # قالب courses.html لا يعرض تفاصيل السعي، لذا نمرر الأسطر كما هي بدون نسخ أو تحليل JSON
     return render_template(
         "courses.html",
-        courses=processed,
-        total_credits=sum(safe_int(c["credits"]) for c in processed),
+        courses=clist,
+        total_credits=sum(safe_int(c["credits"]) for c in clist),
         available_courses=all_courses
     )
 
 @app.route("/research", methods=["GET", "POST"])
 @login_required
+@not_student
+@student_required
 def research():
-    if session["user"].get("role") == "student":
-        return redirect(url_for("student_portal"))
-    sid = session.get("student_id")
-    if not sid:
-        return redirect(url_for("info"))
+    sid = g.student_id
 
-    conn = get_students_db()
-    if request.method == "POST":
-        f = request.files.get("research_file")
-        fname = None
-        if f and f.filename and allowed_file(f.filename):
-            fname = f"research_{sid}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}_{f.filename}"
-            f.save(os.path.join(app.config["UPLOAD_FOLDER"], fname))
-
-        conn.execute(
-            """INSERT OR REPLACE INTO research
-               (student_id, title, supervisor, start_date, keywords, abstract, research_filename, credits, grade)
-               VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, (SELECT research_filename FROM research WHERE student_id=?)), ?, ?)""",
-            (sid, request.form.get("title"), request.form.get("supervisor"), request.form.get("start_date"),
-             ", ".join([k.strip() for k in request.form.getlist("new_keyword[]") if k.strip()]),
-             request.form.get("abstract"), fname, sid,
-             request.form.get("credits", 0), request.form.get("grade"))
-        )
-        conn.commit()
-        conn.close()
-        return redirect(url_for("competency"))
+    with get_students_db() as conn:
+        if request.method == "POST":
+            f = request.files.get("research_file")
+            fname = None
+            if f and f.filename and allowed_file(f.filename):
+                fname = f"research_{sid}_{time.strftime('%Y%m%d%H%M%S')}_{f.filename}"
+                save_upload(f, fname)
 
-    row = conn.execute("SELECT * FROM research WHERE student_id=?", (sid,)).fetchone()
-    conn.close()
-    return render_template("research.html", data=dict(row) if row else {})
+            conn.execute(
+                SQL_SAVE_RESEARCH,
+                (sid, request.form.get("title"), request.form.get("supervisor"), request.form.get("start_date"),
+                 ", ".join([k.strip() for k in request.form.getlist("new_keyword[]") if k.strip()]),
+                 request.form.get("abstract"), fname, sid,
+                 request.form.get("credits", 0), request.form.get("grade"))
+            )
+            conn.commit()
+            return redirect(url_for("competency"))
+
+        row = conn.execute(SQL_GET_RESEARCH, (sid,)).fetchone()
+    return render_template("research.html", data=row or {})
 
 @app.route("/competency", methods=["GET", "POST"])
 @login_required
+@not_student
+@student_required
 def competency():
-    if session["user"].get("role") == "student":
-        return redirect(url_for("student_portal"))
-    sid = session.get("student_id")
-    if not sid:
-        return redirect(url_for("info"))
+    sid = g.student_id
 
-    conn = get_students_db()
-    if request.method == "POST":
-        conn.execute(
-            "INSERT OR REPLACE INTO competency (student_id, exam_result, exam_date, english_result, notes) VALUES (?, ?, ?, ?, ?)",
-            (sid, request.form.get("comp_exam"), request.form.get("comp_date"),
-             request.form.get("achievements"), request.form.get("notes"))
-        )
-        conn.commit()
-        conn.close()
-        return redirect(url_for("plan"))
+    with get_students_db() as conn:
+        if request.method == "POST":
+            conn.execute(
+                SQL_SAVE_COMPETENCY,
+                (sid, request.form.get("comp_exam"), request.form.get("comp_date"),
+                 request.form.get("achievements"), request.form.get("notes"))
+            )
+            conn.commit()
+            return redirect(url_for("plan"))
 
-    row = conn.execute("SELECT * FROM competency WHERE student_id=?", (sid,)).fetchone()
-    conn.close()
+        row = conn.execute(SQL_GET_COMPETENCY, (sid,)).fetchone()
     return render_template(
         "competency.html",
         data={'comp_exam': row['exam_result'], 'comp_date': row['exam_date'],
@@ -789,62 +1443,46 @@ def competency():
 
 @app.route("/plan", methods=["GET", "POST"])
 @login_required
+@not_student
+@student_required
 def plan():
-    if session["user"].get("role") == "student":
-        return redirect(url_for("student_portal"))
-    sid = session.get("student_id")
-    if not sid:
-        return redirect(url_for("info"))
-
-    conn = get_students_db()
-    if request.method == "POST":
-        if request.form.get("action") == "delete_member":
-            curp = conn.execute("SELECT members FROM plan WHERE student_id=?", (sid,)).fetchone()
-            mems = [m.strip() for m in (curp["members"] or "").split(',') if m.strip()]
-            mdel = request.form.get("member_to_delete")
-            if mdel in mems:
-                mems.remove(mdel)
-            conn.execute("INSERT OR REPLACE INTO plan (student_id, members) VALUES (?, ?)", (sid, ", ".join(mems)))
-        else:
-            curp = conn.execute("SELECT members FROM plan WHERE student_id=?", (sid,)).fetchone()
-            mems = [m.strip() for m in (curp["members"] or "").split(',') if m.strip()]
-            for nm in request.form.getlist("new_member[]"):
-                if nm.strip() and nm.strip() not in mems:
-                    mems.append(nm.strip())
-            conn.execute(
-                "INSERT OR REPLACE INTO plan (student_id, committee_name, supervisor, members, discussion_date, notes) VALUES (?, ?, ?, ?, ?, ?)",
-                (sid, request.form.get("committee_name"), request.form.get("supervisor"),
-                 ", ".join(mems), request.form.get("discussion_date"), request.form.get("notes"))
-            )
-        conn.commit()
-        conn.close()
-        return redirect(url_for("review"))
+    sid = g.student_id
+
+    with get_students_db() as conn:
+        if request.method == "POST":
+            with conn:
+                if request.form.get("action") == "delete_member":
+                    conn.execute(SQL_DELETE_PLAN_MEMBER, (sid, request.form.get("member_to_delete")))
+                else:
+                    conn.execute(
+                        SQL_SAVE_PLAN,
+                        (sid, request.form.get("committee_name"), request.form.get("supervisor"),
+                         request.form.get("discussion_date"), request.form.get("notes"))
+                    )
+                    conn.executemany(SQL_ADD_PLAN_MEMBER, [
+                        (sid, nm.strip()) for nm in request.form.getlist("new_member[]") if nm.strip()
+                    ])
+            return redirect(url_for("review"))
 
-    row = conn.execute("SELECT * FROM plan WHERE student_id=?", (sid,)).fetchone()
-    conn.close()
-    return render_template("plan.html", data=dict(row) if row else {})
+        row = conn.execute(SQL_GET_PLAN, (sid,)).fetchone()
+        members = [m["name"] for m in conn.execute(SQL_GET_PLAN_MEMBERS, (sid,))]
+    return render_template("plan.html", data=row or {}, members=members)
 
 @app.route("/review")
 @login_required
+@student_required
 def review():
-    sid = session.get("student_id")
-    if not sid:
-        return redirect(url_for("info"))
+    sid = g.student_id
 
-    conn = get_students_db()
-    data = {
-        's': conn.execute("SELECT * FROM students WHERE id=?", (sid,)).fetchone(),
-        'a': conn.execute("SELECT * FROM admission WHERE student_id=?", (sid,)).fetchone(),
-        'c': conn.execute("SELECT * FROM courses WHERE student_id=?", (sid,)).fetchall(),
-        'r': conn.execute("SELECT * FROM research WHERE student_id=?", (sid,)).fetchone(),
-        'comp': conn.execute("SELECT * FROM competency WHERE student_id=?", (sid,)).fetchone(),
-        'p': conn.execute("SELECT * FROM plan WHERE student_id=?", (sid,)).fetchone()
-    }
-    conn.close()
+    # الطالب مع جداوله الفرعية (JOIN)، ثم قائمة المواد وأعضاء اللجنة
+    with get_students_db() as conn:
+        data = _fetch_student_joined(conn, SQL_STUDENT_FULL, _FULL_JOINS, sid)
+        clist = conn.execute(SQL_GET_COURSES, (sid,)).fetchall()
+        members = [m["name"] for m in conn.execute(SQL_GET_PLAN_MEMBERS, (sid,))]
     return render_template(
         "review.html",
-        student=data['s'], admission=data['a'], courses=data['c'],
-        research=data['r'], competency=data['comp'], plan=data['p']
+        student=data['students'], admission=data['admission'], courses=clist,
+        research=data['research'], competency=data['competency'], plan=data['plan'], members=members
     )
 
 
@@ -852,18 +1490,22 @@ def review():
 #  إدارة الطلاب (Admin Operations)
 # ========================================================
 
+STUDENTS_PAGE_SIZE = 50
+STUDENTS_PAGE_MAX = 500
+
 @app.route("/admin/students")
 @login_required
 @admin_only
 def admin_students_list():
-    conn = get_students_db()
-    sql = ("SELECT s.id, s.full_name, s.student_id, s.study_type, s.level, a.avg, a.type as admission_type "
-           "FROM students s LEFT JOIN admission a ON s.id = a.student_id WHERE 1=1")
+    """ قائمة الطلاب مع البحث والتصفية، على صفحات من STUDENTS_PAGE_SIZE طالب """
+    sql = SQL_STUDENTS_LIST
     params = []
 
     if request.args.get("q"):
-        sql += " AND (s.full_name LIKE ? OR s.student_id LIKE ?)"
-        params.extend([f"%{request.args.get('q')}%"] * 2)
+        clause, p = _search_clause(request.args.get("q"), "students_fts", "s.id",
+                                   [("full_name", "s.full_name"), ("student_id", "s.student_id")])
+        sql += " AND " + clause
+        params.extend(p)
     if request.args.get("level"):
         sql += " AND s.level = ?"
         params.append(request.args.get("level"))
@@ -871,10 +1513,28 @@ def admin_students_list():
         sql += " AND s.study_type = ?"
         params.append(request.args.get("study_type"))
 
-    sql += " ORDER BY s.id DESC"
-    res = conn.execute(sql, params).fetchall()
-    conn.close()
-    return render_template("admin_students_list.html", students=res)
+    # ترقيم بالمفتاح (keyset): الصفحة التالية تبدأ بعد آخر id معروض، فكلفة كل صفحة ثابتة
+    after = safe_int(request.args.get("after"))
+    if after > 0:
+        sql += " AND s.id < ?"
+        params.append(after)
+    limit = min(safe_int(request.args.get("limit"), STUDENTS_PAGE_SIZE), STUDENTS_PAGE_MAX)
+    # صفر أو قيمة سالبة تعني في SQLite "بلا حد"، فنعود للحجم الافتراضي
+    if limit <= 0:
+        limit = STUDENTS_PAGE_SIZE
+    # نطلب سطراً إضافياً لمعرفة وجود صفحة تالية بدون استعلام COUNT
+    sql += " ORDER BY s.id DESC LIMIT ?"
+    params.append(limit + 1)
+    with get_students_db() as conn:
+        res = conn.execute(sql, params).fetchall()
+
+    next_url = None
+    if len(res) > limit:
+        res = res[:limit]
+        args = request.args.to_dict()
+        args["after"] = res[-1]["id"]
+        next_url = url_for("admin_students_list", **args)
+    return render_template("admin_students_list.html", students=res, next_url=next_url)
 
 @app.route("/admin/student/<int:student_id>/full_edit")
 @login_required
@@ -894,75 +1554,55 @@ def admin_student_view(student_id):
 @login_required
 @admin_only
 def admin_student_edit(student_id):
-    conn = get_students_db()
-    if request.method == "POST":
-        total_g, count_c = 0, 0
-        courses_rows = conn.execute("SELECT id FROM courses WHERE student_id=?", (student_id,)).fetchall()
-        for c in courses_rows:
-            cid = c["id"]
-            breakdown = [safe_int(request.form.get(f"cw{i}_{cid}", 0)) for i in range(1, 6)]
-            cw_tot = sum(breakdown)
-            final = safe_int(request.form.get(f"final_{cid}", 0))
-            grade = cw_tot + final
-
-            conn.execute(
-                "UPDATE courses SET coursework_total=?, coursework_breakdown=?, final_exam=?, grade=? WHERE id=?",
-                (cw_tot, json.dumps(breakdown), final, grade, cid)
-            )
-            total_g += grade
-            count_c += 1
-
-        avg = round(total_g / count_c, 2) if count_c else 0
-        conn.execute(
-            "INSERT OR REPLACE INTO admission (student_id, type, year, avg, notes) VALUES (?, ?, ?, ?, ?)",
-            (student_id, request.form.get("type"), request.form.get("year"), str(avg), request.form.get("notes"))
-        )
-        conn.commit()
-        conn.close()
-        return redirect(url_for("admin_students_list"))
-
-    s = conn.execute("SELECT * FROM students WHERE id=?", (student_id,)).fetchone()
-    a = conn.execute("SELECT * FROM admission WHERE student_id=?", (student_id,)).fetchone()
-    c = conn.execute("SELECT * FROM courses WHERE student_id=?", (student_id,)).fetchall()
+    with get_students_db() as conn:
+        if request.method == "POST":
+            updates = []
+            # أرقام المواد من أسماء حقول النموذج نفسه (final_<id>) بدلاً من استعلام مسبق
+            # isdecimal وليس isdigit: الأخير يقبل رموزاً مثل "²" يرفضها int()
+            cids = sorted(int(k[6:]) for k in request.form if k.startswith("final_") and k[6:].isdecimal())
+            for cid in cids:
+                breakdown = [safe_int(request.form.get(f"cw{i}_{cid}", 0)) for i in range(1, 6)]
+                cw_tot = sum(breakdown)
+                final = safe_int(request.form.get(f"final_{cid}", 0))
+                updates.append((cw_tot, json_dumps(breakdown), final, cw_tot + final, cid, student_id))
+
+            with conn:
+                conn.executemany(SQL_GRADE_COURSE, updates)
+                # المعدل من درجات المواد المحفوظة فعلاً بعد التحديث (داخل المعاملة نفسها)،
+                # فلا يدخل فيه رقم مادة قديم أو لطالب آخر تجاوزه شرط student_id
+                avg = conn.execute(SQL_COURSES_AVG, (student_id,)).fetchone()[0]
+                avg = round(avg, 2) if avg is not None else 0
+                conn.execute(
+                    SQL_SAVE_ADMISSION_AVG,
+                    (student_id, request.form.get("type"), request.form.get("year"), str(avg), request.form.get("notes"))
+                )
+            invalidate_portal(student_id)
+            return redirect(url_for("admin_students_list"))
 
-    proc_c = []
-    for co in c:
-        d = dict(co)
-        try:
-            d['coursework_breakdown'] = json.loads(co['coursework_breakdown'] or '[0,0,0,0,0]')
-        except:
-            d['coursework_breakdown'] = [0] * 5
-        proc_c.append(d)
+        data = _fetch_student_joined(conn, SQL_STUDENT_ADMISSION, (_ADMISSION_JOIN,), student_id)
+        s, a = data['students'], data['admission']
+        c = conn.execute(SQL_GET_COURSES, (student_id,)).fetchall()
 
-    conn.close()
-    return render_template("admin_student_edit.html", student=s, admission=a, courses=proc_c)
+    return render_template("admin_student_edit.html", student=s, admission=a, courses=c)
 
 @app.route("/admin/student/<int:student_id>/delete", methods=["POST"])
 @login_required
 @admin_only
 def admin_student_delete(student_id):
-    conn = get_students_db()
-
-    s = conn.execute("SELECT image_filename FROM students WHERE id=?", (student_id,)).fetchone()
-    if s and s["image_filename"]:
-        try:
-            os.remove(os.path.join(app.config["UPLOAD_FOLDER"], s["image_filename"]))
-        except:
-            pass
-
-    r = conn.execute("SELECT research_filename FROM research WHERE student_id=?", (student_id,)).fetchone()
-    if r and r["research_filename"]:
-        try:
-            os.remove(os.path.join(app.config["UPLOAD_FOLDER"], r["research_filename"]))
-        except:
-            pass
-
-    for t in ["students", "admission", "courses", "research", "competency", "plan"]:
-        col = "id" if t == 'students' else "student_id"
-        conn.execute(f"DELETE FROM {t} WHERE {col}=?", (student_id,))
-
-    conn.commit()
-    conn.close()
+    with get_students_db() as conn:
+        # اسما الصورة وملف البحث باستعلام واحد
+        row = conn.execute(SQL_STUDENT_FILES, (student_id,)).fetchone()
+
+        # كل عمليات الحذف في معاملة واحدة (مزامنة واحدة للقرص)
+        with conn:
+            for sql in SQL_DELETE_STUDENT:
+                conn.execute(sql, (student_id,))
+    # الملفات تُحذف بعد نجاح المعاملة فقط، وفي الخلفية حتى لا ينتظرها الرد
+    remove_uploads_later(row or ())
+    invalidate_portal(student_id)
+    # معالج الإدخال لا يكتب بعد الآن لطالب محذوف (المفاتيح الخارجية مفعلة وسيفشل الإدخال)
+    if session.get("student_id") == student_id:
+        session.pop("student_id")
     flash("تم الحذف", "success")
     return redirect(url_for("admin_students_list"))
 
@@ -970,46 +1610,38 @@ def admin_student_delete(student_id):
 @login_required
 @admin_only
 def admin_export_csv():
-    conn = get_students_db()
-    students = conn.execute(
-        "SELECT s.id, s.full_name, s.student_id, s.level, s.study_type, s.department, s.college, a.avg, a.type "
-        "FROM students s LEFT JOIN admission a ON s.id=a.student_id ORDER BY s.id DESC"
-    ).fetchall()
-    conn.close()
-
-    out = "\ufeffID,الاسم,الرقم الجامعي,المرحلة,الدراسة,القسم,الكلية,المعدل,القبول\n"
-    for s in students:
-        row = [str(s[k] or "") for k in s.keys()]
-        out += ",".join([f'"{r}"' if "," in r else r for r in row]) + "\n"
-
-    resp = make_response(out)
-    resp.headers["Content-Disposition"] = "attachment; filename=students.csv"
-    resp.headers["Content-type"] = "text/csv; charset=utf-8"
-    return resp
+    def generate():
+        # نكتب كل سطر في مخزن صغير ونرسله مباشرة بدلاً من بناء الملف كاملاً في الذاكرة
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(["ID", "الاسم", "الرقم الجامعي", "المرحلة", "الدراسة", "القسم", "الكلية", "المعدل", "القبول"])
+        yield "\ufeff" + buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+        with get_students_db() as conn:
+            for s in conn.execute(SQL_EXPORT_STUDENTS):
+                # القيم الفارغة (None و 0 و "") تُكتب حقلاً فارغاً كما في التصدير السابق
+                writer.writerow([v or "" for v in s])
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+
+    return Response(
+        stream_with_context(generate()),
+        content_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": "attachment; filename=students.csv"}
+    )
 
 @app.route("/admin/student/<int:student_id>/print_application")
 @login_required
 def admin_student_print(student_id):
-    conn = get_students_db()
-    s = conn.execute("SELECT * FROM students WHERE id=?", (student_id,)).fetchone()
-    a = conn.execute("SELECT * FROM admission WHERE student_id=?", (student_id,)).fetchone()
-    c = conn.execute("SELECT * FROM courses WHERE student_id=?", (student_id,)).fetchall()
-    r = conn.execute("SELECT * FROM research WHERE student_id=?", (student_id,)).fetchone()
-    comp = conn.execute("SELECT * FROM competency WHERE student_id=?", (student_id,)).fetchone()
-    p = conn.execute("SELECT * FROM plan WHERE student_id=?", (student_id,)).fetchone()
-    conn.close()
-
-    sum1, cnt1, sum2, cnt2, creds = 0, 0, 0, 0, 0
-    for co in c:
-        try:
-            gr = float(co["grade"])
-            creds += int(co["credits"] or 0)
-            if 'أول' in (co["semester"] or ""):
-                sum1, cnt1 = sum1 + gr, cnt1 + 1
-            elif 'ثاني' in (co["semester"] or ""):
-                sum2, cnt2 = sum2 + gr, cnt2 + 1
-        except:
-            pass
+    with get_students_db() as conn:
+        data = _fetch_student_joined(conn, SQL_STUDENT_FULL, _FULL_JOINS, student_id)
+        c = conn.execute(SQL_GET_COURSES, (student_id,)).fetchall()
+        sum1, cnt1, sum2, cnt2, creds = conn.execute(SQL_PRINT_GRADES, (student_id,)).fetchone()
+    s, a, r = data['students'], data['admission'], data['research']
+    comp, p = data['competency'], data['plan']
 
     return render_template(
         "print_student.html",
@@ -1029,42 +1661,37 @@ def admin_student_print(student_id):
 def research_registry():
     q = request.args.get("q", "").strip()
     ftype = request.args.get("filter_type", "title")
-    sql = ("SELECT s.full_name, s.student_id as uid, r.title, r.supervisor, r.start_date, r.research_filename "
-           "FROM research r JOIN students s ON r.student_id=s.id WHERE 1=1")
+    sql = SQL_RESEARCH_REGISTRY
     params = []
 
     if q:
-        if ftype == "student_name":
-            sql += " AND s.full_name LIKE ?"
-            params.append(f"%{q}%")
-        elif ftype == "supervisor":
-            sql += " AND r.supervisor LIKE ?"
-            params.append(f"%{q}%")
-        elif ftype == "title":
-            sql += " AND r.title LIKE ?"
-            params.append(f"%{q}%")
-        elif ftype == "date":
-            sql += " AND r.start_date LIKE ?"
-            params.append(f"%{q}%")
-        elif ftype == "id":
-            sql += " AND s.student_id LIKE ?"
-            params.append(f"%{q}%")
+        research_cols = {"supervisor": ("supervisor", "r.supervisor"), "title": ("title", "r.title"),
+                         "date": ("start_date", "r.start_date")}
+        student_cols = {"student_name": ("full_name", "s.full_name"), "id": ("student_id", "s.student_id")}
+        if ftype in research_cols:
+            clause, params = _search_clause(q, "research_fts", "r.student_id", [research_cols[ftype]])
+        elif ftype in student_cols:
+            clause, params = _search_clause(q, "students_fts", "s.id", [student_cols[ftype]])
         else:
-            sql += " AND (r.title LIKE ? OR s.full_name LIKE ?)"
-            params.extend([f"%{q}%", f"%{q}%"])
+            c1, p1 = _search_clause(q, "research_fts", "r.student_id", [research_cols["title"]])
+            c2, p2 = _search_clause(q, "students_fts", "s.id", [student_cols["student_name"]])
+            clause, params = f"({c1} OR {c2})", p1 + p2
+        sql += " AND " + clause
 
-    conn = get_students_db()
-    res = conn.execute(sql, params).fetchall()
-    conn.close()
+    with get_students_db() as conn:
+        res = conn.execute(sql, params).fetchall()
     return render_template("research_registry.html", researches=res, filter_type=ftype)
 
 @app.route("/uploads/<path:filename>")
 def uploaded_file(filename):
-    # حماية بسيطة: منع الخروج خارج uploads
-    safe_path = os.path.normpath(filename).replace("\\", "/")
-    if safe_path.startswith("../") or safe_path.startswith("/"):
+    # safe_join يرفض أي مسار يخرج من مجلد uploads (.. أو مسار مطلق)
+    if safe_join(app.config["UPLOAD_FOLDER"], filename) is None:
         abort(403)
-    return send_file(os.path.join(app.config["UPLOAD_FOLDER"], safe_path))
+    # أسماء الملفات المرفوعة تبدأ بتاريخ ووقت الرفع، فالاسم لا يشير لمحتوى آخر أبداً:
+    # المتصفح يحتفظ بها لسنة بدون إعادة تحقق، ويبقى 304 عبر ETag لمن يطلبها مجدداً
+    resp = send_from_directory(app.config["UPLOAD_FOLDER"], filename, conditional=True, max_age=31536000)
+    resp.cache_control.immutable = True
+    return resp
 
 @app.errorhandler(403)
 def forbidden(e):
@@ -1079,4 +1706,15 @@ def health():
     return {"ok": True}
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    # خادم التطوير (مع المنقح وإعادة التحميل) فقط عند طلبه صراحة: FLASK_DEBUG=1 python server.py
+    # على السيرفر يُفضل: gunicorn wsgi:app (انظر wsgi.py)
+    if os.environ.get("FLASK_DEBUG") == "1":
+        app.run(debug=True)
+    else:
+        try:
+            from waitress import serve
+        except ImportError:
+            print("waitress غير مثبت: تشغيل خادم Flask المدمج (للإنتاج استخدم waitress أو gunicorn)")
+            app.run(threaded=True)
+        else:
+            serve(app, host="127.0.0.1", port=5000, threads=8)
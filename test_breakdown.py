@@ -0,0 +1,67 @@
+# test_breakdown.py
+# python -m unittest test_breakdown
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import server
+
+
+class ParseBreakdownTest(unittest.TestCase):
+
+    def test_bad_marks_become_zero(self):
+        self.assertEqual(server._parse_breakdown('[10, "", 5, 5, 5]'), [10, 0, 5, 5, 5])
+        self.assertEqual(server._parse_breakdown('[5, null, 3, 4, 2]'), [5, 0, 3, 4, 2])
+        self.assertEqual(server._parse_breakdown('["7.5", "x", 8.0, [1], true]'), [7.5, 0, 8, 0, 1])
+
+    def test_empty_or_unreadable_text(self):
+        self.assertEqual(server._parse_breakdown(""), [])
+        self.assertEqual(server._parse_breakdown(None), [])
+        self.assertEqual(server._parse_breakdown("[]"), [])
+        self.assertEqual(server._parse_breakdown("[10, 5"), [])
+        self.assertEqual(server._parse_breakdown("5"), [])
+        self.assertIsNone(server._parse_breakdown("[10, 5", strict=True))
+        self.assertIsNone(server._parse_breakdown('{"a": 1}', strict=True))
+
+
+class BreakdownMigrationTest(unittest.TestCase):
+    """ ترحيل درجات السعي القديمة عند التشغيل على نسخة مؤقتة من قاعدة البيانات """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        path = os.path.join(self.tmp, "students.db")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE courses (id INTEGER PRIMARY KEY AUTOINCREMENT, student_id INTEGER, "
+                     "course_name TEXT, coursework_breakdown TEXT DEFAULT '[]')")
+        conn.executemany(
+            "INSERT INTO courses (id, student_id, course_name, coursework_breakdown) VALUES (?, 1, 'مادة', ?)",
+            [(1, '[10, "", 5, 5, 5]'), (2, '[5, null, 3, 4, 2]'), (3, '[1.0, 2.5, "3"]'),
+             (4, '[10, 5'), (5, '[1,2,3,4,5]')],
+        )
+        conn.commit()
+        conn.close()
+        self._pool = server._students_pool
+        server._students_pool = server.ConnectionPool(path)
+
+    def tearDown(self):
+        server._students_pool.drain()
+        server._students_pool = self._pool
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_mixed_marks_keep_valid_grades(self):
+        with server.app.app_context():
+            server.init_students_db()
+            with server.get_students_db() as conn:
+                rows = dict(conn.execute("SELECT id, coursework_breakdown FROM courses"))
+        self.assertEqual(rows[1], "[10,0,5,5,5]")
+        self.assertEqual(rows[2], "[5,0,3,4,2]")
+        self.assertEqual(rows[3], "[1,2.5,3]")
+        # النص التالف لا يُستبدل بقائمة فارغة
+        self.assertEqual(rows[4], "[10, 5")
+        self.assertEqual(rows[5], "[1,2,3,4,5]")
+
+
+if __name__ == "__main__":
+    unittest.main()
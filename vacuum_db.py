@@ -0,0 +1,28 @@
+# vacuum_db.py
+import sqlite3
+import os
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "students.db")
+PAGE_SIZE = 8192
+
+def vacuum():
+    if not os.path.exists(DB_PATH):
+        print("Database does not exist yet. It will be created by server.py.")
+        return
+
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+
+    # لا يمكن تغيير page_size في وضع WAL، لذا نخرج منه مؤقتاً ثم نعود إليه
+    cur.execute("PRAGMA journal_mode=DELETE")
+    cur.execute(f"PRAGMA page_size={PAGE_SIZE}")
+    cur.execute("VACUUM")
+    cur.execute("PRAGMA journal_mode=WAL")
+
+    page_size = cur.execute("PRAGMA page_size").fetchone()[0]
+    print(f"Database vacuumed, page_size={page_size}.")
+
+    conn.close()
+
+if __name__ == "__main__":
+    vacuum()
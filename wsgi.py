@@ -0,0 +1,18 @@
+# wsgi.py
+# نقطة الدخول للإنتاج عبر gunicorn مع عمال gevent:
+#   gunicorn -k gevent -w 2 --worker-connections 1000 wsgi:app
+# (PythonAnywhere يستورد server.app مباشرة من ملف WSGI الخاص به ولا يحتاج هذا الملف)
+
+# يجب أن يسبق الترقيع أي استيراد آخر، حتى تصبح الأقفال والـ sockets تعاونية
+# قبل أن ينشئ server.py مجمع الاتصالات وأقفاله
+try:
+    from gevent import monkey
+    monkey.patch_all()
+except ImportError:
+    # بدون gevent يعمل الملف نفسه مع العمال العاديين (gunicorn -w 4 wsgi:app)
+    pass
+
+from server import app  # noqa: E402
+
+if __name__ == "__main__":
+    app.run()